@@ -1,16 +1,19 @@
 import os
 import dash
+import flask
 import dash_html_components as html
 import dash_core_components as dcc
 from dash.dependencies import Input, Output, State
 
 from recipe_database.database_access import RecipeDatabaseAccesser, extract_text
 from recipe_database.convert_recipes import RecipeConverter
+from recipe_database.recipe_previews import RecipePreviewCache
 
 
 class RecipeDatabaseGui:
     def __init__(self):
         self.db_access = RecipeDatabaseAccesser()
+        self.previews = RecipePreviewCache()
 
         self.search_bar_id = "search_bar"
         self.recipe_dropdown_id = "recipe_dropdown"
@@ -119,9 +122,22 @@ class RecipeDatabaseGui:
         children.append(html.Br())
         children.append(html.Div(f"Tags: {tags}"))
 
+        children.append(self._create_recipe_preview_div(file_path))
         children.append(self._create_recipe_modification_div(recipe_name))
         return html.Div(children, id="recipe-content")
 
+    def _create_recipe_preview_div(self, file_path):
+        previews = self.previews.get_previews(file_path)
+        children = []
+        for preview in previews:
+            children.append(
+                html.Img(
+                    src=f"/{self.previews.cache_folder}/{preview}",
+                    style={"width": "300px", "margin": "5px", "border": "1px solid #ccc"},
+                )
+            )
+        return html.Div(children, style={"margin-top": "20px"})
+
     def _create_word_doc_open_button(self, display):
         return html.Button("Open Word Document", id="open-doc-button", style={"display": display})
 
@@ -310,6 +326,7 @@ def add_call_backs(app: dash.Dash, gui: RecipeDatabaseGui):
             text = extract_text(filename)
 
             gui.db_access.add_recipe(recipe_name, text, filename, web_address, tags)
+            gui.previews.get_previews(filename)
             return f"Added {recipe_name} to database"
 
         return ""
@@ -354,10 +371,24 @@ def add_call_backs(app: dash.Dash, gui: RecipeDatabaseGui):
         return ""
 
 
+def add_preview_route(app: dash.Dash, gui: RecipeDatabaseGui):
+
+    @app.server.route(f"/{gui.previews.cache_folder}/<path:preview>")
+    def serve_recipe_preview(preview):
+        """
+        Previews are stored under the hash of their word document so their contents never change
+        and the browser can cache them indefinitely
+        """
+        response = flask.send_from_directory(os.path.abspath(gui.previews.cache_folder), preview)
+        response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        return response
+
+
 if __name__ == "__main__":
 
     gui = RecipeDatabaseGui()
     app = dash.Dash(__name__)
     app.layout = gui.full_layout
     add_call_backs(app, gui)
+    add_preview_route(app, gui)
     app.run_server(debug=True)
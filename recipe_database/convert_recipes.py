@@ -1,19 +1,28 @@
 #!/usr/bin/env python3
 import re
 import os
+import io
 import time
+import json
+import uuid
+import shutil
+import argparse
 from contextlib import contextmanager
-from typing import List
-from PIL import Image
+from typing import Callable, Iterator, List, Optional, Tuple
+from PIL import Image, ImageOps
 from selenium import webdriver
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.chrome.options import Options
 
 import cv2
+import numpy
 import pytesseract
 import docx
 import pdf2image
 
+from recipe_database.structured_recipe import StructuredRecipe, extract_recipe_from_html
+from recipe_database.work_queue import LeasedWorkQueue, LeaseLostError, get_file_version_name
+
 
 @contextmanager
 def cd(path):
@@ -38,14 +47,41 @@ class RecipeConverter:
         Usage:
         1. Put images and pdfs of recipes into the `recipes_to_convert` directory
         2. Do the `run` command
+
+        To split a large batch across several processes or machines, point each of them at the
+        same (shared) workspace directory and use `run_shared_queue` instead of `run`
         """
         self.converter_workspace_dir = "~/Desktop/recipe_converter"
         self.input_folder = "recipes_to_convert"
         self.word_folder = "converted_recipes"
+        self.queue_folder = "recipe_queue"
+        self.checkpoint_folder = "conversion_checkpoints"
+        # checkpoints can be shared by several workers, so each one writes temporary files under its own name
+        self.checkpoint_writer_id = uuid.uuid4().hex
+        self.original_images_folder = f"{self.word_folder}/original_images"
+        self.queue_poll_interval = 10.0
 
         self.valid_image_types = [".pdf", ".jpg", ".jpeg", ".png", ".jpe", ".bmp", ".jp2", ".tiff", ".tif"]
+        self.tiff_image_types = [".tiff", ".tif"]
         self.known_extra_files = [".DS_Store", ".gitkeep"]
 
+        self.max_ocr_image_size = (2000, 2000)
+        self.reduced_read_flags = {
+            2: cv2.IMREAD_REDUCED_COLOR_2,
+            4: cv2.IMREAD_REDUCED_COLOR_4,
+            8: cv2.IMREAD_REDUCED_COLOR_8,
+        }
+
+        self.word_image_width_inches = 7
+        self.word_image_max_height_inches = 9
+        self.word_image_dpi = 200
+        self.word_image_jpeg_quality = 85
+        self.word_image_png_max_colors = 32
+        self.word_image_formats_kept_as_is = ["JPEG", "PNG", "GIF", "BMP"]
+        self.exif_orientation_tag = 0x0112
+        self.slice_tall_images = True
+        self.keep_original_images = False
+
     def run(self):
         """
         Finds all the image and pdf files in the `recipes_to_convert` directory
@@ -63,24 +99,152 @@ class RecipeConverter:
                     if filename not in self.known_extra_files:
                         print(f"Warning unable to convert {filename}. Unknown image extension")
 
-    def _convert_image_to_word(self, filename: str):
-        original_image_file = f"{self.input_folder}/{filename}"
+    def run_shared_queue(self, worker_id: str = ""):
+        """
+        Convert the files in `recipes_to_convert` together with any other workers
+        using the same workspace directory.
+        Files are claimed through leases in the `recipe_queue` directory.
+        Keeps polling until every file is finished so that files claimed by
+        crashed workers get picked up once their lease expires.
+        """
+        with cd(os.path.expanduser(self.converter_workspace_dir)):
+            self._make_directory(self.word_folder)
+            queue = LeasedWorkQueue(self.queue_folder, worker_id, input_folder=self.input_folder)
+
+            while True:
+                files_to_convert = self._find_files_to_convert()
+                if not queue.get_unfinished(files_to_convert):
+                    break
+
+                filename = queue.claim_next(files_to_convert)
+                if filename is None:
+                    time.sleep(self.queue_poll_interval)
+                    continue
+
+                with queue.keep_alive(filename):
+                    self._convert_claimed_file(queue, filename)
+                queue.release(filename)
+
+    def _find_files_to_convert(self) -> List[str]:
+        return sorted(f for f in os.listdir(self.input_folder) if self._is_a_valid_pdf_or_image_type(f))
+
+    def _convert_claimed_file(self, queue: LeasedWorkQueue, filename: str):
+        """
+        Write the word document under a worker specific name and only move it into place,
+        with an atomic rename, if this worker still holds the lease.
+        The page checkpoints are shared by all workers, so they are only removed by the lease owner;
+        a worker that lost its lease leaves them to the worker that reclaimed the file
+        """
         word_file = f"{self.word_folder}/{self._make_word_file_name(filename)}"
+        partial_word_file = f"{word_file}.{queue.worker_id}.partial"
+        try:
+            self._convert_image_to_word(
+                filename, partial_word_file, remove_checkpoints=False, lease_check=lambda: queue.still_owns(filename)
+            )
+        except LeaseLostError:
+            print(f"Lease on {filename} was lost. Stopping this worker's conversion")
+            self._remove_file_if_exists(partial_word_file)
+            return
+        except Exception as e:
+            print(f"Warning unable to convert {filename}. {e}")
+            self._remove_file_if_exists(partial_word_file)
+            if queue.still_owns(filename):
+                queue.mark_failed(filename, str(e))
+            return
+
+        if queue.still_owns(filename):
+            os.replace(partial_word_file, word_file)
+            shutil.rmtree(self._get_checkpoint_directory(f"{self.input_folder}/{filename}"))
+            queue.mark_done(filename)
+        else:
+            print(f"Lease on {filename} was lost. Discarding this worker's result")
+            self._remove_file_if_exists(partial_word_file)
+
+    def _remove_file_if_exists(self, file: str):
+        if os.path.exists(file):
+            os.remove(file)
+
+    def _convert_image_to_word(
+        self,
+        filename: str,
+        word_file: str = "",
+        remove_checkpoints=True,
+        lease_check: Optional[Callable[[], bool]] = None,
+    ):
+        original_image_file = f"{self.input_folder}/{filename}"
+        if not word_file:
+            word_file = f"{self.word_folder}/{self._make_word_file_name(filename)}"
 
-        doc = docx.Document()
-        images, image_files = self._read_images_from_file(original_image_file)
-        self._write_text_section_of_word_doc(doc, images)
+        checkpoint_dir = self._get_checkpoint_directory(original_image_file)
+        self._convert_pages_with_checkpoints(original_image_file, checkpoint_dir, lease_check)
+        pages = self._read_page_checkpoints(checkpoint_dir)
 
-        for image_file in image_files:
+        doc = docx.Document()
+        for text, _ in pages:
+            self._write_parsed_text_to_word_doc(doc, text)
+        for _, image_file in pages:
             self._write_image_to_word_doc(doc, image_file)
-            if self._filetype_is_pdf(original_image_file):
-                os.system(f'rm "{image_file}"')
         doc.save(word_file)
-
-    def _write_text_section_of_word_doc(self, doc: docx.document.Document, images: List[cv2.Mat]):
-        for image in images:
+        if self.keep_original_images:
+            self._keep_original_image(original_image_file)
+        if remove_checkpoints:
+            shutil.rmtree(checkpoint_dir)
+
+    def _convert_pages_with_checkpoints(
+        self, original_image_file: str, checkpoint_dir: str, lease_check: Optional[Callable[[], bool]] = None
+    ):
+        """
+        OCR one page at a time so only a single decoded page is held in memory.
+        The text and image of every page are checkpointed as soon as the page is done so
+        an interrupted conversion resumes from the first unfinished page.
+        In shared mode `lease_check` stops the conversion once another worker has taken over the file
+        """
+        first_page = len(self._read_page_checkpoints(checkpoint_dir))
+        if first_page > 0:
+            print(f"Resuming {original_image_file} from page {first_page + 1}")
+
+        pages = self._read_images_from_file(original_image_file, checkpoint_dir, first_page)
+        for page_number, (image, image_file) in enumerate(pages, start=first_page):
+            if lease_check is not None and not lease_check():
+                raise LeaseLostError(original_image_file)
             text = self._read_text_from_image(image)
-            self._write_parsed_text_to_word_doc(doc, text)
+            self._save_page_checkpoint(checkpoint_dir, page_number, text, image_file)
+
+    def _get_checkpoint_directory(self, original_image_file: str) -> str:
+        """
+        Checkpoints are keyed by the size and modification time of the file
+        so a replaced file doesn't resume from the old file's pages
+        """
+        checkpoint_dir = f"{self.checkpoint_folder}/{get_file_version_name(original_image_file)}"
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        return checkpoint_dir
+
+    def _get_page_checkpoint_file(self, checkpoint_dir: str, page_number: int) -> str:
+        return f"{checkpoint_dir}/page{page_number}.json"
+
+    def _save_page_checkpoint(self, checkpoint_dir: str, page_number: int, text: str, image_file: str):
+        """
+        Atomically write the page's json file, which marks the page as finished.
+        Generated page images are already rendered into the checkpoint directory
+        """
+        checkpoint_file = self._get_page_checkpoint_file(checkpoint_dir, page_number)
+        temporary_file = f"{checkpoint_file}.{self.checkpoint_writer_id}.tmp"
+        with open(temporary_file, "w") as f:
+            json.dump({"text": text, "image_file": image_file}, f)
+        os.replace(temporary_file, checkpoint_file)
+
+    def _read_page_checkpoints(self, checkpoint_dir: str) -> List[Tuple[str, str]]:
+        """
+        The text and image file of each finished page, in page order
+        """
+        pages: List[Tuple[str, str]] = []
+        checkpoint_file = self._get_page_checkpoint_file(checkpoint_dir, len(pages))
+        while os.path.exists(checkpoint_file):
+            with open(checkpoint_file) as f:
+                page = json.load(f)
+            pages.append((page["text"], page["image_file"]))
+            checkpoint_file = self._get_page_checkpoint_file(checkpoint_dir, len(pages))
+        return pages
 
     def _is_a_valid_pdf_or_image_type(self, filename):
         file_extension = os.path.splitext(filename)[-1]
@@ -89,7 +253,7 @@ class RecipeConverter:
     def _read_text_from_image(self, image):
         image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)  # Convert BGR to RGB
         image = Image.fromarray(image_rgb)  # Convert to PIL Image
-        max_size = (2000, 2000)
+        max_size = self.max_ocr_image_size
         if image.size[0] > max_size[0] or image.size[1] > max_size[1]:
             image.thumbnail(max_size)
         text = pytesseract.image_to_string(image)
@@ -104,16 +268,99 @@ class RecipeConverter:
         if not os.path.exists(directory):
             os.mkdir(directory)
 
-    def _read_images_from_file(self, image_filename: str):
+    def _read_images_from_file(
+        self, image_filename: str, page_image_folder: str, first_page: int = 0
+    ) -> Iterator[Tuple[cv2.Mat, str]]:
+        """
+        Lazily yield each page of the file, starting at `first_page`, as an image for OCR
+        along with the image file to embed in the word document for that page.
+        Page images rendered from pdfs and multi-page tiffs are written to `page_image_folder`
+        """
         print("Reading", image_filename)
         if self._filetype_is_pdf(image_filename):
-            return self._convert_pdf_to_images(image_filename)
+            return self._convert_pdf_to_images(image_filename, page_image_folder, first_page)
+        elif self._filetype_is_tiff(image_filename):
+            return self._read_tiff_frames(image_filename, page_image_folder, first_page)
         else:
-            return [cv2.imread(image_filename)], [image_filename]
+            return self._read_single_image(image_filename, first_page)
+
+    def _read_single_image(self, image_filename: str, first_page: int = 0) -> Iterator[Tuple[cv2.Mat, str]]:
+        if first_page == 0:
+            yield self._read_image_at_ocr_size(image_filename), image_filename
+
+    def _read_image_at_ocr_size(self, image_filename: str) -> cv2.Mat:
+        """
+        Decode the image at a reduced resolution if it is bigger than needed for OCR.
+        For jpegs, the reduction happens during decoding, which is much faster than
+        decoding the full image and shrinking it afterwards.
+        """
+        with Image.open(image_filename) as image:  # only reads the header
+            reduction_factor = self._get_ocr_reduction_factor(image.size)
+
+        if reduction_factor in self.reduced_read_flags:
+            return cv2.imread(image_filename, self.reduced_read_flags[reduction_factor])
+        return cv2.imread(image_filename)
+
+    def _get_ocr_reduction_factor(self, image_size: Tuple[int, int]) -> int:
+        """
+        Largest power of two reduction that keeps the image at least as large as the OCR size
+        """
+        width, height = image_size
+        max_width, max_height = self.max_ocr_image_size
+        reduction_factor = 1
+        for factor in sorted(self.reduced_read_flags):
+            if width // factor < max_width and height // factor < max_height:
+                break
+            reduction_factor = factor
+        return reduction_factor
+
+    def _read_tiff_frames(
+        self, tiff_filename: str, page_image_folder: str, first_page: int = 0
+    ) -> Iterator[Tuple[cv2.Mat, str]]:
+        """
+        Single frame tiffs are read by cv2 like any other image.
+        Multi-page tiff scans are read one frame at a time. Each frame is decoded at full size,
+        saved as a jpg to embed in the word document, then shrunk with `Image.reduce` for OCR.
+        """
+        with Image.open(tiff_filename) as tiff:
+            number_of_frames = getattr(tiff, "n_frames", 1)
+        if number_of_frames == 1:
+            yield from self._read_single_image(tiff_filename, first_page)
+            return
+
+        with Image.open(tiff_filename) as tiff:
+            for i in range(first_page, number_of_frames):
+                tiff.seek(i)
+                frame = self._convert_frame_to_rgb(tiff)
+
+                image_file = self._make_page_image_file_name(page_image_folder, tiff_filename, i)
+                self._save_page_image(frame, image_file)
+
+                reduction_factor = self._get_ocr_reduction_factor(frame.size)
+                if reduction_factor > 1:
+                    frame = frame.reduce(reduction_factor)
+                yield cv2.cvtColor(numpy.array(frame), cv2.COLOR_RGB2BGR), image_file
+
+    def _convert_frame_to_rgb(self, frame: Image.Image) -> Image.Image:
+        """
+        Pillow's convert clips 16 bit and 32 bit grayscale scans to 255 instead of scaling them,
+        so scale those to 8 bits first
+        """
+        if not frame.mode.startswith("I;16") and frame.mode not in ("I", "F"):
+            return frame.convert("RGB")
+
+        pixels = numpy.asarray(frame, dtype=numpy.float64)
+        # 32 bit scans usually hold 16 bit values, but some only use the 8 bit range
+        max_value = 255 if frame.mode in ("I", "F") and pixels.max() <= 255 else 65535
+        pixels = numpy.clip(pixels * 255 / max_value, 0, 255).astype(numpy.uint8)
+        return Image.fromarray(pixels, "L").convert("RGB")
 
     def _filetype_is_pdf(self, image_file: str):
         return ".pdf" == self._get_file_extension(image_file)
 
+    def _filetype_is_tiff(self, image_file: str):
+        return self._get_file_extension(image_file).lower() in self.tiff_image_types
+
     def _get_file_rootname(self, file: str) -> str:
         return os.path.splitext(file)[0]
 
@@ -123,27 +370,133 @@ class RecipeConverter:
     def _make_word_file_name(self, image_file: str) -> str:
         return self._get_file_rootname(image_file) + ".docx"
 
+    def _make_page_image_file_name(self, page_image_folder: str, image_file: str, page_number: int) -> str:
+        file_root = self._get_file_rootname(os.path.basename(image_file))
+        return f"{page_image_folder}/{file_root}{page_number}.jpg"
+
+    def _save_page_image(self, image: Image.Image, image_file: str):
+        """
+        Write the page image under this writer's own name and rename it into place
+        so other workers never read a half written image
+        """
+        temporary_file = f"{image_file}.{self.checkpoint_writer_id}.tmp"
+        image.save(temporary_file, "JPEG")
+        os.replace(temporary_file, image_file)
+
     def _convert_pdf_name_to_jpg_image_name(self, image_filename: str) -> str:
         return self._get_file_rootname(image_filename) + ".jpg"
 
     def _make_string_xml_compatible(self, line: str):
         re.sub("[^\u0020-\uD7FF\u0009\u000A\u000D\uE000-\uFFFD\U00010000-\U0010FFFF]+", "", line)
 
-    def _convert_pdf_to_images(self, pdf_filename: str):
-        cv_imgs: List[cv2.Mat] = []
-        image_filenames: List[str] = []
-        pil_images: List[Image] = pdf2image.convert_from_path(pdf_filename)
+    def _convert_pdf_to_images(
+        self, pdf_filename: str, page_image_folder: str, first_page: int = 0
+    ) -> Iterator[Tuple[cv2.Mat, str]]:
+        """
+        Render the pdf one page at a time rather than rasterizing the whole document up front
+        """
+        number_of_pages = pdf2image.pdfinfo_from_path(pdf_filename)["Pages"]
 
-        for i, pil_image in enumerate(pil_images):
-            file_root = self._get_file_rootname(pdf_filename)
-            jpg_file = f"{file_root}{i}.jpg"
-            pil_image.save(jpg_file, "JPEG")
-            cv_imgs.append(cv2.imread(jpg_file))
-            image_filenames.append(jpg_file)
-        return cv_imgs, image_filenames
+        for i in range(first_page, number_of_pages):
+            pil_image = pdf2image.convert_from_path(pdf_filename, first_page=i + 1, last_page=i + 1)[0]
+            jpg_file = self._make_page_image_file_name(page_image_folder, pdf_filename, i)
+            self._save_page_image(pil_image, jpg_file)
+            pil_image.close()
+            yield self._read_image_at_ocr_size(jpg_file), jpg_file
 
     def _write_image_to_word_doc(self, doc: docx.document.Document, image_path: str):
-        doc.add_picture(image_path, width=docx.shared.Inches(7))
+        """
+        Embed the image re-encoded at `word_image_dpi` for the displayed width instead of at full resolution.
+        Very tall images, like full page website screenshots, are split into page sized pieces.
+        Images that are already small enough are embedded as they are to avoid re-encoding losses.
+        """
+        with Image.open(image_path) as image:
+            if self._image_can_be_embedded_as_is(image):
+                doc.add_picture(image_path, width=docx.shared.Inches(self.word_image_width_inches))
+                return
+
+            image = self._downsample_image_for_word(image)
+            page_images = self._slice_image_into_pages(image) if self.slice_tall_images else [image]
+            for page_image in page_images:
+                doc.add_picture(
+                    self._encode_image_for_word(page_image), width=docx.shared.Inches(self.word_image_width_inches)
+                )
+
+    def _image_can_be_embedded_as_is(self, image: Image.Image) -> bool:
+        target_width = int(self.word_image_width_inches * self.word_image_dpi)
+        needs_slicing = self.slice_tall_images and image.height > self._get_page_height(image.width)
+        is_rotated = image.getexif().get(self.exif_orientation_tag, 1) != 1
+        return (
+            image.format in self.word_image_formats_kept_as_is
+            and image.width <= target_width
+            and not needs_slicing
+            and not is_rotated
+        )
+
+    def _get_page_height(self, image_width: int) -> int:
+        return int(image_width * self.word_image_max_height_inches / self.word_image_width_inches)
+
+    def _keep_original_image(self, original_image_file: str):
+        """
+        Copy the input file to its own folder, named after the input file, so pages and files
+        with similar names can't overwrite each other
+        """
+        name = os.path.basename(original_image_file)
+        kept_image_folder = f"{self.original_images_folder}/{name}"
+        os.makedirs(kept_image_folder, exist_ok=True)
+        shutil.copyfile(original_image_file, f"{kept_image_folder}/{name}")
+
+    def _downsample_image_for_word(self, image: Image.Image) -> Image.Image:
+        """
+        Re-encoding drops the exif orientation, so apply it to the pixels to match what the OCR read
+        """
+        target_width = int(self.word_image_width_inches * self.word_image_dpi)
+        # reduced decoding for jpegs, ignored otherwise. Square so it is big enough in either orientation
+        image.draft("RGB", (target_width, target_width))
+        image = ImageOps.exif_transpose(image)
+        target_height = max(1, round(image.height * target_width / image.width))
+
+        has_transparency = image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGBA" if has_transparency else "RGB")
+
+        if image.width > target_width:
+            image = image.resize((target_width, target_height), Image.LANCZOS)
+        return image
+
+    def _slice_image_into_pages(self, image: Image.Image) -> List[Image.Image]:
+        page_height = self._get_page_height(image.width)
+        if image.height <= page_height:
+            return [image]
+        return [
+            image.crop((0, top, image.width, min(top + page_height, image.height)))
+            for top in range(0, image.height, page_height)
+        ]
+
+    def _encode_image_for_word(self, image: Image.Image) -> io.BytesIO:
+        stream = io.BytesIO()
+        if self._image_is_better_as_png(image):
+            image.save(stream, "PNG", optimize=True, dpi=(self.word_image_dpi, self.word_image_dpi))
+        else:
+            image.convert("RGB").save(
+                stream,
+                "JPEG",
+                quality=self.word_image_jpeg_quality,
+                optimize=True,
+                dpi=(self.word_image_dpi, self.word_image_dpi),
+            )
+        stream.seek(0)
+        return stream
+
+    def _image_is_better_as_png(self, image: Image.Image) -> bool:
+        """
+        Transparent images and images with only a few colors (text and graphics) compress better as png,
+        photographs and scans, including grayscale scans, compress better as jpeg
+        """
+        if image.mode == "RGBA":
+            return True
+        sample = image.resize((min(image.width, 128), min(image.height, 128)), Image.NEAREST)
+        return sample.getcolors(maxcolors=self.word_image_png_max_colors) is not None
 
     def convert_a_website(self, recipe_name, web_address):
         chrome_options = Options()
@@ -156,6 +509,11 @@ class RecipeConverter:
         driver.get(web_address)
         time.sleep(3)
 
+        output_filename = self.convert_html_to_word(recipe_name, driver.page_source)
+        if output_filename:
+            driver.quit()
+            return output_filename
+
         total_width = driver.execute_script("return document.body.scrollWidth")
         total_height = driver.execute_script("return document.body.scrollHeight")
         driver.set_window_size(total_width, total_height)
@@ -172,10 +530,55 @@ class RecipeConverter:
         output_filename = f"{self.word_folder}/{recipe_name}.docx"
         return output_filename
 
+    def convert_html_to_word(self, recipe_name: str, page_html: str) -> str:
+        """
+        Write the schema.org Recipe data (JSON-LD or microdata) of a web page directly to a word document,
+        which is much faster and more accurate than OCR of a screenshot.
+        Returns the word document's file name, or an empty string if the page has no recipe data
+        """
+        recipe = extract_recipe_from_html(page_html)
+        if recipe is None:
+            return ""
+
+        print("Found recipe data for", recipe_name)
+        self._make_directory(self.word_folder)
+        output_filename = f"{self.word_folder}/{recipe_name}.docx"
+        doc = docx.Document()
+        self._write_structured_recipe_to_word_doc(doc, recipe_name, recipe)
+        doc.save(output_filename)
+        return output_filename
+
+    def _write_structured_recipe_to_word_doc(
+        self, doc: docx.document.Document, recipe_name: str, recipe: StructuredRecipe
+    ):
+        doc.add_heading(recipe.name if recipe.name else recipe_name, level=1)
+        if recipe.ingredients:
+            doc.add_heading("Ingredients", level=2)
+            for ingredient in recipe.ingredients:
+                doc.add_paragraph(ingredient, style="List Bullet")
+        if recipe.instructions:
+            doc.add_heading("Instructions", level=2)
+            for step in recipe.instructions:
+                doc.add_paragraph(step, style="List Number")
+
 
 def main():
+    parser = argparse.ArgumentParser(description="Convert images and pdfs of recipes into word documents")
+    parser.add_argument("--workspace", default="", help="Directory holding recipes_to_convert and converted_recipes")
+    parser.add_argument(
+        "--shared", action="store_true", help="Share the conversions with other workers using the same workspace"
+    )
+    parser.add_argument("--worker-id", default="", help="Name of this worker in shared mode. Defaults to host-pid")
+    args = parser.parse_args()
+
     converter = RecipeConverter()
-    converter.run()
+    if args.workspace:
+        converter.converter_workspace_dir = args.workspace
+
+    if args.shared:
+        converter.run_shared_queue(args.worker_id)
+    else:
+        converter.run()
 
 
 if __name__ == "__main__":
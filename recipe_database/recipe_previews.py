@@ -0,0 +1,111 @@
+import os
+import io
+import shutil
+import hashlib
+import tempfile
+from typing import Dict, Iterator, List, Tuple
+from PIL import Image, features
+
+import docx
+from docx.enum.shape import WD_INLINE_SHAPE
+
+
+class RecipePreviewCache:
+    """
+    Small thumbnails of the page images embedded in the recipe word documents.
+
+    The thumbnails of a word document are cached on disk in a folder named after the hash
+    of the document, so they are only made once, are remade automatically when the
+    document changes, and can be cached by the browser indefinitely.
+    """
+
+    def __init__(self, cache_folder="recipe_previews", max_size=(600, 800), quality=80):
+        self.cache_folder = cache_folder
+        self.max_size = max_size
+        self.quality = quality
+
+        webp_supported = features.check("webp")
+        self.image_format = "WEBP" if webp_supported else "JPEG"
+        self.image_extension = ".webp" if webp_supported else ".jpg"
+
+        self._file_hashes: Dict[Tuple[str, int, int], str] = {}
+
+    def get_previews(self, docx_path: str) -> List[str]:
+        """
+        Paths of the preview images relative to the cache folder, in page order.
+        The previews are made on first use
+        """
+        if not docx_path or not os.path.exists(docx_path):
+            return []
+
+        preview_folder_name = self._hash_file(docx_path)
+        preview_folder = f"{self.cache_folder}/{preview_folder_name}"
+        if not os.path.exists(preview_folder) and not self._create_previews(docx_path, preview_folder):
+            return []
+
+        return [f"{preview_folder_name}/{preview}" for preview in sorted(os.listdir(preview_folder))]
+
+    def _create_previews(self, docx_path: str, preview_folder: str) -> bool:
+        """
+        Write the previews to a temporary folder and rename it into place
+        so a half finished set of previews is never served.
+        The gui server is threaded, so every request gets its own temporary folder.
+        Returns False if the word document can't be read
+        """
+        os.makedirs(self.cache_folder, exist_ok=True)
+        temporary_folder = tempfile.mkdtemp(dir=self.cache_folder, suffix=".tmp")
+
+        try:
+            image_blobs = list(self._read_embedded_images(docx_path))
+        except Exception as e:  # e.g. a corrupt document or one locked by Word
+            print(f"Warning unable to read {docx_path} to make previews. {e}")
+            shutil.rmtree(temporary_folder, ignore_errors=True)
+            return False
+
+        for i, image_blob in enumerate(image_blobs):
+            preview_file = f"{temporary_folder}/page{i:04d}{self.image_extension}"
+            try:
+                self._write_thumbnail(image_blob, preview_file)
+            except Exception as e:  # e.g. emf/wmf pictures added in Word that Pillow can't convert
+                print(f"Warning unable to make preview {i} of {docx_path}. {e}")
+
+        try:
+            os.rename(temporary_folder, preview_folder)
+        except OSError:  # another request made the same previews first
+            shutil.rmtree(temporary_folder, ignore_errors=True)
+        return True
+
+    def _write_thumbnail(self, image_blob: bytes, preview_file: str):
+        with Image.open(io.BytesIO(image_blob)) as image:
+            image.draft("RGB", self.max_size)  # reduced decoding for jpegs, ignored otherwise
+            thumbnail = image.convert("RGB")
+            thumbnail.thumbnail(self.max_size)
+            thumbnail.save(preview_file, self.image_format, quality=self.quality)
+
+    def _read_embedded_images(self, docx_path: str) -> Iterator[bytes]:
+        """
+        The documents can be edited in Word, so skip charts, SmartArt and linked pictures
+        that have no embedded image
+        """
+        doc = docx.Document(docx_path)
+        for shape in doc.inline_shapes:
+            if shape.type != WD_INLINE_SHAPE.PICTURE:
+                continue
+            relationship_id = shape._inline.graphic.graphicData.pic.blipFill.blip.embed
+            if relationship_id is None or relationship_id not in doc.part.related_parts:
+                continue
+            yield doc.part.related_parts[relationship_id].blob
+
+    def _hash_file(self, file_path: str) -> str:
+        """
+        sha256 of the file contents, remembered until the file's size or modification time changes
+        """
+        stat = os.stat(file_path)
+        key = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+        if key not in self._file_hashes:
+            file_hash = hashlib.sha256()
+            with open(file_path, "rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    file_hash.update(chunk)
+            self._file_hashes[key] = file_hash.hexdigest()
+        return self._file_hashes[key]
@@ -0,0 +1,210 @@
+import re
+import json
+import html
+from html.parser import HTMLParser
+from typing import List, Optional
+
+
+class StructuredRecipe:
+    """
+    The parts of a schema.org Recipe that go into the word document
+    """
+
+    def __init__(self, name: str, ingredients: List[str], instructions: List[str]):
+        self.name = name
+        self.ingredients = ingredients
+        self.instructions = instructions
+
+
+def extract_recipe_from_html(page_html: str) -> Optional[StructuredRecipe]:
+    """
+    Find a schema.org Recipe in the JSON-LD or microdata of a web page.
+    Returns None if the page doesn't have one with ingredients or instructions
+    """
+    parser = _RecipeHtmlParser()
+    parser.feed(page_html)
+    parser.close()
+
+    for json_ld_block in parser.json_ld_blocks:
+        recipe = _find_json_ld_recipe(json_ld_block)
+        if recipe is not None:
+            return recipe
+    return parser.get_microdata_recipe()
+
+
+def _clean_text(text: str) -> str:
+    """
+    Remove html tags, entities, characters that aren't allowed in xml and extra whitespace
+    """
+    text = html.unescape(re.sub("<[^>]*>", " ", text))
+    text = re.sub("[^\u0020-\uD7FF\u0009\u000A\u000D\uE000-\uFFFD\U00010000-\U0010FFFF]+", "", text)
+    return " ".join(text.split())
+
+
+def _clean_lines(lines: List[str]) -> List[str]:
+    cleaned_lines = [_clean_text(line) for line in lines]
+    return [line for line in cleaned_lines if line]
+
+
+def _is_recipe_type(item_type) -> bool:
+    if isinstance(item_type, list):
+        return any(_is_recipe_type(t) for t in item_type)
+    return isinstance(item_type, str) and item_type.split("/")[-1] == "Recipe"
+
+
+def _find_json_ld_recipe(json_ld_block: str) -> Optional[StructuredRecipe]:
+    try:
+        data = json.loads(json_ld_block, strict=False)  # sites often have raw newlines inside strings
+    except ValueError:
+        return None
+
+    items = data if isinstance(data, list) else [data]
+    while items:
+        item = items.pop(0)
+        if not isinstance(item, dict):
+            continue
+        if _is_recipe_type(item.get("@type")):
+            recipe = _make_json_ld_recipe(item)
+            if recipe is not None:
+                return recipe
+        graph = item.get("@graph", [])
+        items.extend(graph if isinstance(graph, list) else [graph])
+    return None
+
+
+def _make_json_ld_recipe(item: dict) -> Optional[StructuredRecipe]:
+    ingredients = item.get("recipeIngredient", item.get("ingredients", []))
+    if isinstance(ingredients, str):
+        ingredients = [ingredients]
+    ingredients = _clean_lines([i for i in ingredients if isinstance(i, str)])
+    instructions = _clean_lines(_flatten_json_ld_instructions(item.get("recipeInstructions", [])))
+
+    if not ingredients and not instructions:
+        return None
+    name = item.get("name", "")
+    return StructuredRecipe(_clean_text(name) if isinstance(name, str) else "", ingredients, instructions)
+
+
+def _flatten_json_ld_instructions(instructions) -> List[str]:
+    """
+    Instructions can be a string, a list of strings, HowToSteps or HowToSections of steps
+    """
+    if isinstance(instructions, str):
+        return re.split(r"\n+|<br\s*/?>|</p>|</li>", instructions)
+    if isinstance(instructions, list):
+        steps: List[str] = []
+        for instruction in instructions:
+            steps.extend(_flatten_json_ld_instructions(instruction))
+        return steps
+    if isinstance(instructions, dict):
+        if "itemListElement" in instructions:
+            section_name = instructions.get("name", "")
+            section = [section_name] if isinstance(section_name, str) else []
+            return section + _flatten_json_ld_instructions(instructions["itemListElement"])
+        return _flatten_json_ld_instructions(instructions.get("text", instructions.get("name", "")))
+    return []
+
+
+class _RecipeHtmlParser(HTMLParser):
+    """
+    Collects the JSON-LD script blocks of a page and the properties of a microdata Recipe
+    """
+
+    void_tags = ["area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"]
+    line_break_tags = ["br", "div", "li", "p", "tr", "h1", "h2", "h3", "h4", "h5", "h6"]
+    wanted_properties = ["name", "recipeIngredient", "ingredients", "recipeInstructions"]
+    # marks the breaks between items, unlike newlines from the formatting of the html source
+    item_break = "\x00"
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.json_ld_blocks: List[str] = []
+        self.microdata = {"name": [], "ingredients": [], "instructions": []}
+        self.found_microdata_recipe = False
+
+        self._json_ld_text: Optional[List[str]] = None
+        # each open element is [tag, is_recipe_scope or None if not a scope, property name, captured text]
+        self._open_elements: List[list] = []
+
+    def get_microdata_recipe(self) -> Optional[StructuredRecipe]:
+        ingredients = _clean_lines(self.microdata["ingredients"])
+        instructions = _clean_lines(self.microdata["instructions"])
+        if not self.found_microdata_recipe or (not ingredients and not instructions):
+            return None
+        names = _clean_lines(self.microdata["name"])
+        return StructuredRecipe(names[0] if names else "", ingredients, instructions)
+
+    def handle_starttag(self, tag, attrs):
+        attributes = dict(attrs)
+        if tag == "script" and (attributes.get("type") or "").strip().lower() == "application/ld+json":
+            self._json_ld_text = []
+            return
+
+        if tag in self.line_break_tags:
+            self._add_text_to_captures(self.item_break)
+
+        property_name = self._get_wanted_recipe_property(attributes.get("itemprop") or "")
+        captured_text = None
+        if property_name and attributes.get("content") is not None:
+            self._store_property(property_name, attributes["content"])
+        elif property_name:
+            captured_text = []
+
+        scope = None
+        if "itemscope" in attributes:
+            scope = _is_recipe_type(attributes.get("itemtype") or "")
+            self.found_microdata_recipe = self.found_microdata_recipe or scope
+
+        if tag not in self.void_tags:
+            self._open_elements.append([tag, scope, property_name, captured_text])
+
+    def handle_endtag(self, tag):
+        if tag == "script" and self._json_ld_text is not None:
+            self.json_ld_blocks.append("".join(self._json_ld_text))
+            self._json_ld_text = None
+            return
+
+        open_tags = [element[0] for element in self._open_elements]
+        if tag not in open_tags:
+            return
+        while self._open_elements:
+            open_tag, _, property_name, captured_text = self._open_elements.pop()
+            if captured_text is not None:
+                self._store_property(property_name, "".join(captured_text))
+            if open_tag == tag:
+                break
+
+        if tag in self.line_break_tags:
+            self._add_text_to_captures(self.item_break)
+
+    def handle_data(self, data):
+        if self._json_ld_text is not None:
+            self._json_ld_text.append(data)
+        else:
+            self._add_text_to_captures(re.sub(r"\s+", " ", data))
+
+    def _get_wanted_recipe_property(self, itemprop: str) -> str:
+        """
+        Only properties that belong directly to a Recipe scope are wanted,
+        not the names of authors, reviews, etc. nested inside it
+        """
+        scopes = [element[1] for element in self._open_elements if element[1] is not None]
+        if not scopes or not scopes[-1]:
+            return ""
+        for property_name in itemprop.split():
+            if property_name in self.wanted_properties:
+                return property_name
+        return ""
+
+    def _add_text_to_captures(self, text: str):
+        for element in self._open_elements:
+            if element[3] is not None:
+                element[3].append(text)
+
+    def _store_property(self, property_name: str, text: str):
+        if property_name == "name":
+            self.microdata["name"].append(text)
+        elif property_name == "recipeInstructions":
+            self.microdata["instructions"].extend(text.split(self.item_break))
+        else:
+            self.microdata["ingredients"].extend(text.split(self.item_break))
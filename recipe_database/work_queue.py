@@ -0,0 +1,249 @@
+import os
+import socket
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import List, Optional
+
+
+def get_file_version_name(file_path: str) -> str:
+    """
+    Name for a version of a file made from its name, size and modification time,
+    so a rescanned file with the same name is treated as a new file
+    """
+    stat = os.stat(file_path)
+    return f"{os.path.basename(file_path)}-{stat.st_size}-{stat.st_mtime_ns}"
+
+
+class LeaseLostError(Exception):
+    """
+    Another worker took over the lease of the file being converted
+    """
+
+
+class LeasedWorkQueue:
+    """
+    A work queue shared between any number of worker processes or machines
+    through a common directory.
+
+    Workers claim a file by atomically creating a lease file for it.
+    While a file is being converted the owner touches its lease file as a heartbeat.
+    A lease that hasn't been touched within `lease_timeout` seconds belongs to a
+    crashed worker and can be reclaimed by another one.
+    Finished files get a marker in the `done` folder so they are only converted once.
+    A file whose conversion raises an error is retried until it has failed `max_attempts` times.
+    Markers are named by the version of the file in `input_folder`, see `get_file_version_name`.
+
+    The shared directory must support exclusive file creation (O_EXCL) and atomic renames,
+    which local disks, NFS and SMB shares do. Hard links are used when available but aren't required.
+
+    Directory layout inside `queue_folder`:
+        leases/<filename>.lease   - the worker currently converting the file
+        done/<file version>       - the file has been converted
+        failed/<file version>     - the number of failed attempts and the last error message.
+                                    Delete it to retry a file that failed `max_attempts` times
+    """
+
+    def __init__(
+        self,
+        queue_folder: str,
+        worker_id: str = "",
+        lease_timeout=600.0,
+        heartbeat_interval=30.0,
+        input_folder: str = "",
+        max_attempts=3,
+    ):
+        self.queue_folder = queue_folder
+        self.input_folder = input_folder
+        self.max_attempts = max_attempts
+        self.worker_id = worker_id if worker_id else f"{socket.gethostname()}-{os.getpid()}"
+        self.lease_token = f"{self.worker_id}-{uuid.uuid4().hex}"
+        self.lease_timeout = lease_timeout
+        self.heartbeat_interval = heartbeat_interval
+
+        self.lease_folder = f"{queue_folder}/leases"
+        self.done_folder = f"{queue_folder}/done"
+        self.failed_folder = f"{queue_folder}/failed"
+        for folder in [self.lease_folder, self.done_folder, self.failed_folder]:
+            os.makedirs(folder, exist_ok=True)
+
+    def claim_next(self, filenames: List[str]) -> Optional[str]:
+        """
+        Try to claim one of the unfinished files.
+        Returns None if every unfinished file is leased by a live worker
+        """
+        for filename in self.get_unfinished(filenames):
+            if self._try_to_claim(filename):
+                return filename
+        return None
+
+    def get_unfinished(self, filenames: List[str]) -> List[str]:
+        return [filename for filename in filenames if not self.is_finished(filename)]
+
+    def is_finished(self, filename: str) -> bool:
+        marker_name = self._get_marker_name(filename)
+        if os.path.exists(f"{self.done_folder}/{marker_name}"):
+            return True
+        return self._get_failed_attempts(marker_name) >= self.max_attempts
+
+    def still_owns(self, filename: str) -> bool:
+        return self._read_lease_token(self._get_lease_file(filename)) == self.lease_token
+
+    def mark_done(self, filename: str):
+        self._write_marker(f"{self.done_folder}/{self._get_marker_name(filename)}", self.worker_id)
+
+    def mark_failed(self, filename: str, message: str):
+        marker_name = self._get_marker_name(filename)
+        failed_attempts = self._get_failed_attempts(marker_name) + 1
+        self._write_marker(f"{self.failed_folder}/{marker_name}", f"{failed_attempts}\n{self.worker_id}: {message}")
+        if failed_attempts >= self.max_attempts:
+            print(f"Giving up on {filename} after {failed_attempts} failed attempts")
+
+    def release(self, filename: str):
+        if self.still_owns(filename):
+            self._remove_if_exists(self._get_lease_file(filename))
+
+    @contextmanager
+    def keep_alive(self, filename: str):
+        """
+        Heartbeat the lease of a claimed file from a background thread
+        for as long as the context is open.
+        The heartbeat only stops early once the lease belongs to another worker. A missing or unreadable
+        lease can be a reclaim attempt putting a fresh lease back or a hiccup of a network share, so keep trying
+        """
+        lease_file = self._get_lease_file(filename)
+        stop = threading.Event()
+
+        def heartbeat():
+            while not stop.wait(self.heartbeat_interval):
+                try:
+                    lease_token = self._read_lease_token(lease_file)
+                    if lease_token == self.lease_token:
+                        self._touch(lease_file)
+                    elif lease_token:
+                        print(f"Lease on {filename} was taken over by {lease_token}")
+                        break
+                except OSError as e:
+                    print(f"Warning unable to heartbeat the lease on {filename}. {e}")
+
+        thread = threading.Thread(target=heartbeat, daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    def _try_to_claim(self, filename: str) -> bool:
+        lease_file = self._get_lease_file(filename)
+        if not self._try_to_create_lease(lease_file) and not self._try_to_reclaim_expired_lease(lease_file):
+            return False
+
+        if self.is_finished(filename):  # finished between listing and claiming
+            self.release(filename)
+            return False
+        return True
+
+    def _try_to_create_lease(self, lease_file: str) -> bool:
+        try:
+            fd = os.open(lease_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, "w") as f:
+            f.write(self.lease_token)
+        return True
+
+    def _try_to_reclaim_expired_lease(self, lease_file: str) -> bool:
+        """
+        Move the expired lease aside with an atomic rename so only one worker can reclaim it.
+        If the lease turned out to be fresh by the time it was moved, another worker
+        reclaimed it first, so put it back.
+        """
+        expired_token = self._read_lease_token(lease_file)
+        if expired_token is None or not self._lease_has_expired(lease_file):
+            return False
+
+        moved_lease_file = f"{lease_file}.{self.lease_token}.expired"
+        try:
+            os.rename(lease_file, moved_lease_file)
+        except FileNotFoundError:
+            return False
+        except OSError as e:
+            print(f"Warning unable to reclaim {os.path.basename(lease_file)}. {e}")
+            return False
+
+        if self._read_lease_token(moved_lease_file) != expired_token:
+            self._put_lease_back(moved_lease_file, lease_file)
+            return False
+
+        self._remove_if_exists(moved_lease_file)
+        print(f"Reclaiming {os.path.basename(lease_file)} from expired lease {expired_token}")
+        return self._try_to_create_lease(lease_file)
+
+    def _put_lease_back(self, moved_lease_file: str, lease_file: str):
+        """
+        Restore another worker's fresh lease without overwriting a lease created in the meantime.
+        Many network shares don't support hard links, so fall back to exclusively creating
+        the lease with the same token
+        """
+        try:
+            os.link(moved_lease_file, lease_file)
+        except FileExistsError:
+            pass
+        except OSError:
+            lease_token = self._read_lease_token(moved_lease_file)
+            try:
+                fd = os.open(lease_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                with os.fdopen(fd, "w") as f:
+                    f.write(lease_token if lease_token else "")
+            except FileExistsError:
+                pass
+        self._remove_if_exists(moved_lease_file)
+
+    def _lease_has_expired(self, lease_file: str) -> bool:
+        try:
+            return time.time() - os.path.getmtime(lease_file) > self.lease_timeout
+        except FileNotFoundError:
+            return False
+
+    def _get_marker_name(self, filename: str) -> str:
+        file_path = f"{self.input_folder}/{filename}"
+        if self.input_folder and os.path.exists(file_path):
+            return get_file_version_name(file_path)
+        return filename
+
+    def _get_failed_attempts(self, marker_name: str) -> int:
+        try:
+            with open(f"{self.failed_folder}/{marker_name}") as f:
+                return int(f.readline())
+        except FileNotFoundError:
+            return 0
+        except ValueError:  # written by hand, treat it as given up on
+            return self.max_attempts
+
+    def _get_lease_file(self, filename: str) -> str:
+        return f"{self.lease_folder}/{filename}.lease"
+
+    def _read_lease_token(self, lease_file: str) -> Optional[str]:
+        try:
+            with open(lease_file) as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _write_marker(self, marker_file: str, contents: str):
+        with open(marker_file, "w") as f:
+            f.write(contents)
+
+    def _touch(self, path: str):
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+
+    def _remove_if_exists(self, path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,265 @@
+import io
+import os
+
+import docx
+import numpy
+import pytest
+from PIL import Image
+
+from recipe_database.convert_recipes import RecipeConverter
+from recipe_database.work_queue import LeaseLostError
+
+
+def make_scan(width, height, mode="L", seed=0):
+    """
+    Noisy gradient that looks like a photographed or scanned page to a compressor
+    """
+    random = numpy.random.default_rng(seed)
+    gradient = numpy.linspace(60, 200, width)[numpy.newaxis, :].repeat(height, axis=0)
+    pixels = numpy.clip(gradient + random.normal(0, 20, (height, width)), 0, 255).astype(numpy.uint8)
+    return Image.fromarray(pixels, "L").convert(mode)
+
+
+def make_graphic(width, height):
+    """
+    Black text-like bars on white, like a website screenshot
+    """
+    image = Image.new("RGB", (width, height), "white")
+    for top in range(10, height - 10, 40):
+        image.paste((0, 0, 0), (20, top, width - 20, top + 12))
+    return image
+
+
+def embedded_images(doc):
+    return [Image.open(io.BytesIO(shape_blob)) for shape_blob in embedded_blobs(doc)]
+
+
+def embedded_blobs(doc):
+    blobs = []
+    for shape in doc.inline_shapes:
+        relationship_id = shape._inline.graphic.graphicData.pic.blipFill.blip.embed
+        blobs.append(doc.part.related_parts[relationship_id].blob)
+    return blobs
+
+
+def test_grayscale_scans_are_embedded_as_jpeg(tmp_path):
+    image_path = str(tmp_path / "scan.png")
+    make_scan(2800, 3000).save(image_path)
+
+    doc = docx.Document()
+    RecipeConverter()._write_image_to_word_doc(doc, image_path)
+
+    [embedded] = embedded_images(doc)
+    assert embedded.format == "JPEG"
+    assert embedded.width == 1400
+
+
+def test_few_color_graphics_are_embedded_as_png(tmp_path):
+    image_path = str(tmp_path / "screenshot.jpg")
+    make_graphic(2000, 1000).save(image_path, "PNG")
+
+    doc = docx.Document()
+    RecipeConverter()._write_image_to_word_doc(doc, image_path)
+
+    [embedded] = embedded_images(doc)
+    assert embedded.format == "PNG"
+    assert embedded.width == 1400
+
+
+def test_small_images_are_embedded_without_re_encoding(tmp_path):
+    image_path = str(tmp_path / "small.jpg")
+    make_scan(800, 1000, "RGB").save(image_path, "JPEG", quality=60)
+
+    doc = docx.Document()
+    RecipeConverter()._write_image_to_word_doc(doc, image_path)
+
+    with open(image_path, "rb") as f:
+        assert embedded_blobs(doc) == [f.read()]
+
+
+def test_tall_images_are_sliced_into_pages(tmp_path):
+    image_path = str(tmp_path / "website.png")
+    make_graphic(1400, 5000).save(image_path)
+
+    doc = docx.Document()
+    RecipeConverter()._write_image_to_word_doc(doc, image_path)
+
+    page_height = 1800  # 1400 pixels wide for 7 inches, 9 inches tall
+    heights = [image.height for image in embedded_images(doc)]
+    assert heights == [page_height, page_height, 5000 - 2 * page_height]
+
+
+def test_tall_images_are_not_sliced_when_slicing_is_off(tmp_path):
+    image_path = str(tmp_path / "website.png")
+    make_graphic(2800, 10000).save(image_path)
+
+    converter = RecipeConverter()
+    converter.slice_tall_images = False
+    doc = docx.Document()
+    converter._write_image_to_word_doc(doc, image_path)
+
+    assert [image.size for image in embedded_images(doc)] == [(1400, 5000)]
+
+
+def test_exif_orientation_is_applied_to_embedded_images(tmp_path):
+    image_path = str(tmp_path / "phone_photo.jpg")
+    exif = Image.Exif()
+    exif[0x0112] = 6  # rotated 90 degrees clockwise
+    make_scan(500, 400, "RGB").save(image_path, "JPEG", exif=exif)
+
+    doc = docx.Document()
+    RecipeConverter()._write_image_to_word_doc(doc, image_path)
+
+    [embedded] = embedded_images(doc)
+    assert embedded.size == (400, 500)
+
+
+def test_kept_originals_of_similarly_named_files_do_not_overwrite_each_other(tmp_path):
+    converter = RecipeConverter()
+    converter.original_images_folder = str(tmp_path / "original_images")
+    for name, contents in [("cake1.pdf", b"cake one"), ("cake.pdf", b"cake"), ("cake10.jpg", b"cake ten")]:
+        (tmp_path / name).write_bytes(contents)
+        converter._keep_original_image(str(tmp_path / name))
+
+    for name, contents in [("cake1.pdf", b"cake one"), ("cake.pdf", b"cake"), ("cake10.jpg", b"cake ten")]:
+        assert (tmp_path / "original_images" / name / name).read_bytes() == contents
+
+
+def save_multi_page_tiff(path, pages):
+    pages[0].save(path, save_all=True, append_images=pages[1:])
+
+
+def test_every_frame_of_a_multi_page_tiff_is_read(tmp_path):
+    tiff_path = str(tmp_path / "cookbook.tif")
+    pages = [Image.new("L", (400, 300), shade) for shade in (40, 120, 200)]
+    save_multi_page_tiff(tiff_path, pages)
+
+    frames = list(RecipeConverter()._read_images_from_file(tiff_path, str(tmp_path)))
+
+    assert [image_file for _, image_file in frames] == [str(tmp_path / f"cookbook{i}.jpg") for i in range(3)]
+    assert [int(image.mean()) for image, _ in frames] == [40, 120, 200]
+
+
+def test_multi_page_tiff_starts_at_the_first_page_asked_for(tmp_path):
+    tiff_path = str(tmp_path / "cookbook.tif")
+    save_multi_page_tiff(tiff_path, [Image.new("L", (400, 300), shade) for shade in (40, 120, 200)])
+
+    frames = list(RecipeConverter()._read_images_from_file(tiff_path, str(tmp_path), first_page=2))
+
+    assert [image_file for _, image_file in frames] == [str(tmp_path / "cookbook2.jpg")]
+
+
+def test_16_bit_tiffs_are_scaled_not_clipped(tmp_path):
+    pixels = numpy.full((300, 400), 30000, dtype=numpy.uint16)  # mid gray in 16 bits
+    single_path = str(tmp_path / "single.tif")
+    multi_path = str(tmp_path / "multi.tif")
+    Image.fromarray(pixels).save(single_path)
+    save_multi_page_tiff(multi_path, [Image.fromarray(pixels), Image.fromarray(pixels)])
+
+    converter = RecipeConverter()
+    [(single_image, single_file)] = converter._read_images_from_file(single_path, str(tmp_path))
+    multi_images = [image for image, _ in converter._read_images_from_file(multi_path, str(tmp_path))]
+
+    assert single_file == single_path
+    for image in [single_image] + multi_images:
+        assert abs(image.mean() - 30000 / 257) < 2
+
+
+def test_large_images_are_decoded_at_a_reduced_size_for_ocr(tmp_path):
+    image_path = str(tmp_path / "big.jpg")
+    make_scan(4400, 3000, "RGB").save(image_path)
+
+    [(image, _)] = RecipeConverter()._read_images_from_file(image_path, str(tmp_path))
+
+    assert image.shape[:2] == (1500, 2200)
+
+
+def test_ocr_reduction_factor_keeps_the_image_at_least_the_ocr_size():
+    converter = RecipeConverter()
+    assert converter._get_ocr_reduction_factor((1500, 1000)) == 1
+    assert converter._get_ocr_reduction_factor((3999, 1000)) == 1
+    assert converter._get_ocr_reduction_factor((4000, 1000)) == 2
+    assert converter._get_ocr_reduction_factor((1000, 8000)) == 4
+    assert converter._get_ocr_reduction_factor((20000, 30000)) == 8
+
+
+class FakePdf:
+    """
+    Stands in for pdf2image and pytesseract: each page is a flat gray image
+    and its text is the page's gray level
+    """
+
+    def __init__(self, shades, interrupt_at_page=None):
+        self.shades = shades
+        self.interrupt_at_page = interrupt_at_page
+        self.pages_read = 0
+
+    def pdfinfo_from_path(self, pdf_filename):
+        return {"Pages": len(self.shades)}
+
+    def convert_from_path(self, pdf_filename, first_page, last_page):
+        return [Image.new("RGB", (850, 1000), (self.shades[first_page - 1],) * 3)]
+
+    def image_to_string(self, image):
+        if self.pages_read == self.interrupt_at_page:
+            raise KeyboardInterrupt
+        self.pages_read += 1
+        shade = image.getpixel((0, 0))[0]
+        return f"Page with shade {shade}\nSecond line"
+
+
+def make_workspace_converter(workspace, monkeypatch, fake_pdf):
+    monkeypatch.setattr("recipe_database.convert_recipes.pdf2image.pdfinfo_from_path", fake_pdf.pdfinfo_from_path)
+    monkeypatch.setattr("recipe_database.convert_recipes.pdf2image.convert_from_path", fake_pdf.convert_from_path)
+    monkeypatch.setattr("recipe_database.convert_recipes.pytesseract.image_to_string", fake_pdf.image_to_string)
+
+    converter = RecipeConverter()
+    converter.input_folder = str(workspace / "recipes_to_convert")
+    converter.word_folder = str(workspace / "converted_recipes")
+    converter.checkpoint_folder = str(workspace / "conversion_checkpoints")
+    for folder in [converter.input_folder, converter.word_folder]:
+        os.makedirs(folder)
+    with open(f"{converter.input_folder}/cookbook.pdf", "wb") as f:
+        f.write(b"%PDF stand in")
+    return converter
+
+
+def read_word_doc(word_file):
+    doc = docx.Document(word_file)
+    return [paragraph.text for paragraph in doc.paragraphs], embedded_blobs(doc)
+
+
+def test_resumed_conversion_matches_an_uninterrupted_one(tmp_path, monkeypatch):
+    shades = [30, 80, 130, 180, 230]
+
+    converter = make_workspace_converter(tmp_path / "uninterrupted", monkeypatch, FakePdf(shades))
+    converter._convert_image_to_word("cookbook.pdf")
+    expected = read_word_doc(f"{converter.word_folder}/cookbook.docx")
+    text, images = expected
+    assert len([line for line in text if line]) == 10 and len(images) == 5
+
+    interrupted_pdf = FakePdf(shades, interrupt_at_page=3)
+    converter = make_workspace_converter(tmp_path / "interrupted", monkeypatch, interrupted_pdf)
+    with pytest.raises(KeyboardInterrupt):
+        converter._convert_image_to_word("cookbook.pdf")
+    assert os.listdir(converter.input_folder) == ["cookbook.pdf"]  # no page images left in the inbox
+
+    interrupted_pdf.interrupt_at_page = None
+    interrupted_pdf.pages_read = 0
+    converter._convert_image_to_word("cookbook.pdf")
+
+    assert interrupted_pdf.pages_read == 2  # only the unfinished pages are OCR'd again
+    assert read_word_doc(f"{converter.word_folder}/cookbook.docx") == expected
+    assert os.listdir(converter.checkpoint_folder) == []
+
+
+def test_conversion_stops_once_the_lease_is_lost(tmp_path, monkeypatch):
+    fake_pdf = FakePdf([30, 80, 130, 180, 230])
+    converter = make_workspace_converter(tmp_path, monkeypatch, fake_pdf)
+    lease_checks = iter([True, True, False])
+
+    with pytest.raises(LeaseLostError):
+        converter._convert_image_to_word("cookbook.pdf", lease_check=lambda: next(lease_checks))
+
+    assert fake_pdf.pages_read == 2
+    assert not os.path.exists(f"{converter.word_folder}/cookbook.docx")
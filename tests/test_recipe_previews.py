@@ -0,0 +1,58 @@
+import threading
+
+import docx
+from PIL import Image
+
+from recipe_database.recipe_previews import RecipePreviewCache
+
+
+def make_word_doc(tmp_path, number_of_pages):
+    doc = docx.Document()
+    doc.add_paragraph("A recipe")
+    for i in range(number_of_pages):
+        image_path = str(tmp_path / f"page{i}.png")
+        Image.new("RGB", (1400, 1800), (40 * i, 100, 150)).save(image_path)
+        doc.add_picture(image_path, width=docx.shared.Inches(7))
+    docx_path = str(tmp_path / "recipe.docx")
+    doc.save(docx_path)
+    return docx_path
+
+
+def test_previews_are_made_once_per_page(tmp_path):
+    cache = RecipePreviewCache(str(tmp_path / "previews"))
+    docx_path = make_word_doc(tmp_path, 3)
+
+    previews = cache.get_previews(docx_path)
+
+    assert len(previews) == 3
+    with Image.open(tmp_path / "previews" / previews[0]) as preview:
+        assert preview.width <= 600 and preview.height <= 800
+    assert cache.get_previews(docx_path) == previews
+
+
+def test_simultaneous_requests_for_the_same_document(tmp_path):
+    cache = RecipePreviewCache(str(tmp_path / "previews"))
+    docx_path = make_word_doc(tmp_path, 3)
+    results = []
+
+    def view_recipe():
+        results.append(cache.get_previews(docx_path))
+
+    threads = [threading.Thread(target=view_recipe) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(results) == 8
+    assert all(result == results[0] and len(result) == 3 for result in results)
+    assert [path.name for path in (tmp_path / "previews").iterdir()] == [results[0][0].split("/")[0]]
+
+
+def test_unreadable_document_has_no_previews(tmp_path):
+    cache = RecipePreviewCache(str(tmp_path / "previews"))
+    docx_path = tmp_path / "corrupt.docx"
+    docx_path.write_bytes(b"not a zip file")
+
+    assert cache.get_previews(str(docx_path)) == []
+    assert list((tmp_path / "previews").iterdir()) == []
@@ -0,0 +1,40 @@
+import os
+
+from recipe_database.structured_recipe import extract_recipe_from_html
+
+
+def read_fixture(filename):
+    with open(os.path.join(os.path.dirname(__file__), "fixtures", filename)) as f:
+        return f.read()
+
+
+def test_json_ld_recipe_with_newlines_inside_strings():
+    recipe = extract_recipe_from_html(read_fixture("json_ld_recipe.html"))
+    assert recipe.name == "Banana Bread & Walnuts"
+    assert recipe.ingredients == ["3 ripe bananas", "2 cups flour", "1/2 cup walnuts"]
+    assert recipe.instructions == ["Mash the bananas.", "Stir in the flour.", "Bake for 1 hour."]
+
+
+def test_json_ld_recipe_in_graph_with_how_to_sections():
+    recipe = extract_recipe_from_html(read_fixture("json_ld_graph_recipe.html"))
+    assert recipe.name == "Pie Crust"
+    assert recipe.ingredients == ["2 cups flour", "1 cup butter", "1/2 cup ice water"]
+    assert recipe.instructions == [
+        "Dough",
+        "Cut the butter into the flour.",
+        "Add the water.",
+        "Baking",
+        "Roll out the dough.",
+        "Bake at 400F for 15 minutes.",
+    ]
+
+
+def test_microdata_recipe_ignores_source_formatting_newlines():
+    recipe = extract_recipe_from_html(read_fixture("microdata_recipe.html"))
+    assert recipe.name == "Tomato Soup"
+    assert recipe.ingredients == ["1 pinch salt", "1 cup all-purpose flour", "6 ripe tomatoes"]
+    assert recipe.instructions == ["Mix the flour with water.", "Simmer the tomatoes", "for 20 minutes."]
+
+
+def test_page_without_recipe_data():
+    assert extract_recipe_from_html(read_fixture("no_recipe.html")) is None
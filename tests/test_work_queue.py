@@ -0,0 +1,132 @@
+import os
+import time
+import random
+import multiprocessing
+
+from recipe_database.work_queue import LeasedWorkQueue
+
+FILES = [f"recipe{i}.jpg" for i in range(30)]
+
+
+def crash_after_claiming(queue_folder):
+    queue = LeasedWorkQueue(queue_folder, "crasher", lease_timeout=1.0, heartbeat_interval=0.1)
+    queue.claim_next(FILES)
+    os._exit(1)  # die without releasing the lease
+
+
+def convert_files(queue_folder, worker_id, log_file):
+    queue = LeasedWorkQueue(queue_folder, worker_id, lease_timeout=1.0, heartbeat_interval=0.1)
+    while queue.get_unfinished(FILES):
+        filename = queue.claim_next(FILES)
+        if filename is None:
+            time.sleep(0.05)
+            continue
+        with queue.keep_alive(filename):
+            time.sleep(random.random() * 0.05)  # the conversion
+            if queue.still_owns(filename):
+                with open(log_file, "a") as f:
+                    f.write(f"{filename}\n")
+                queue.mark_done(filename)
+        queue.release(filename)
+
+
+def run_processes(processes):
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(timeout=60)
+        assert process.exitcode is not None
+
+
+def test_crashed_workers_file_is_reclaimed_and_every_file_is_converted_once(tmp_path):
+    queue_folder = str(tmp_path / "queue")
+    log_file = str(tmp_path / "converted.txt")
+    context = multiprocessing.get_context("spawn")
+
+    run_processes([context.Process(target=crash_after_claiming, args=(queue_folder,))])
+    assert os.listdir(f"{queue_folder}/leases") == [f"{FILES[0]}.lease"]
+
+    workers = [context.Process(target=convert_files, args=(queue_folder, f"worker{i}", log_file)) for i in range(5)]
+    run_processes(workers)
+
+    with open(log_file) as f:
+        converted = f.read().splitlines()
+    assert sorted(converted) == sorted(FILES)
+    assert os.listdir(f"{queue_folder}/leases") == []
+
+
+def test_heartbeat_keeps_a_slow_conversion_leased(tmp_path):
+    queue_folder = str(tmp_path / "queue")
+    owner = LeasedWorkQueue(queue_folder, "owner", lease_timeout=0.5, heartbeat_interval=0.1)
+    other = LeasedWorkQueue(queue_folder, "other", lease_timeout=0.5, heartbeat_interval=0.1)
+
+    filename = owner.claim_next(FILES[:1])
+    with owner.keep_alive(filename):
+        time.sleep(1.5)
+        assert other.claim_next(FILES[:1]) is None
+    assert owner.still_owns(filename)
+
+
+def test_heartbeat_continues_after_the_lease_is_briefly_missing(tmp_path):
+    queue_folder = str(tmp_path / "queue")
+    owner = LeasedWorkQueue(queue_folder, "owner", lease_timeout=0.5, heartbeat_interval=0.1)
+    other = LeasedWorkQueue(queue_folder, "other", lease_timeout=0.5, heartbeat_interval=0.1)
+
+    filename = owner.claim_next(FILES[:1])
+    lease_file = f"{owner.lease_folder}/{filename}.lease"
+    with owner.keep_alive(filename):
+        os.rename(lease_file, f"{lease_file}.moved")  # like a reclaim attempt moving a fresh lease aside
+        time.sleep(0.3)
+        os.rename(f"{lease_file}.moved", lease_file)
+        time.sleep(1.0)
+        assert other.claim_next(FILES[:1]) is None
+
+
+def test_lease_is_put_back_on_shares_without_hard_links(tmp_path, monkeypatch):
+    def link_not_supported(source, destination):
+        raise PermissionError(1, "Operation not permitted")
+
+    monkeypatch.setattr(os, "link", link_not_supported)
+    owner = LeasedWorkQueue(str(tmp_path / "queue"), "owner")
+    other = LeasedWorkQueue(str(tmp_path / "queue"), "other")
+    filename = owner.claim_next(FILES[:1])
+    lease_file = f"{owner.lease_folder}/{filename}.lease"
+    moved_lease_file = f"{lease_file}.{other.lease_token}.expired"
+    os.rename(lease_file, moved_lease_file)  # as a reclaim attempt that found the lease fresh
+
+    other._put_lease_back(moved_lease_file, lease_file)
+
+    assert owner.still_owns(filename)
+    assert not os.path.exists(moved_lease_file)
+
+
+def test_failed_files_are_retried_until_max_attempts(tmp_path):
+    queue = LeasedWorkQueue(str(tmp_path / "queue"), "worker", max_attempts=3)
+
+    for _ in range(2):
+        filename = queue.claim_next(FILES[:1])
+        queue.mark_failed(filename, "share went away")
+        queue.release(filename)
+        assert not queue.is_finished(filename)
+
+    filename = queue.claim_next(FILES[:1])
+    queue.mark_failed(filename, "share went away")
+    queue.release(filename)
+    assert queue.is_finished(filename)
+    assert queue.claim_next(FILES[:1]) is None
+
+
+def test_rescanned_file_with_the_same_name_is_converted_again(tmp_path):
+    input_folder = tmp_path / "recipes_to_convert"
+    input_folder.mkdir()
+    (input_folder / FILES[0]).write_bytes(b"first scan")
+    queue = LeasedWorkQueue(str(tmp_path / "queue"), "worker", input_folder=str(input_folder))
+
+    filename = queue.claim_next(FILES[:1])
+    queue.mark_done(filename)
+    queue.release(filename)
+    assert queue.is_finished(filename)
+
+    (input_folder / FILES[0]).write_bytes(b"second, better scan")
+    assert not queue.is_finished(filename)
+    assert queue.claim_next(FILES[:1]) == filename